@@ -1,13 +1,47 @@
+from __future__ import annotations
+
+import asyncio
+import atexit
+import codecs
+import hashlib
 import os
+import queue
 import re
+import shutil
 import subprocess
 import tempfile
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import TYPE_CHECKING, Final
 
-import docker
 import streamlit as st
-from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from worker import read_message, write_message
+
+# docker and langchain pull in hundreds of modules, so they are only imported once
+# they're needed, keeping the first render of the page fast.
+if TYPE_CHECKING:
+    import docker
+    from langchain_core.messages import SystemMessage
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+WORKER_PATH = Path(__file__).parent / "worker.py"
+DOCKER_IMAGE = "code-interpreter-demo:latest"
+CODE_BLOCK_RE = re.compile(r"```python\n(.*?)\n?```", re.DOTALL)
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+SCRIPT_ROOT = (
+    Path("/dev/shm") if os.path.isdir("/dev/shm") else Path(tempfile.gettempdir())
+)
+MAX_CACHED_SCRIPTS = 64
+MAX_CACHED_RESPONSES = 128
+REAP_INTERVAL = 30
+STALE_PARTIAL_AGE = 60
+STREAM_RENDER_INTERVAL = 0.25
 
 st.set_page_config(page_title="Code Interpreter")
 st.header("Code Interpreter")
@@ -27,10 +61,16 @@ execution_env = st.selectbox(
     help=help_text,
 )
 
+show_stream = st.checkbox(
+    "Show streaming output",
+    value=True,
+    help="Uncheck to only show the generated code once the response is complete.",
+)
+
 user_prompt = st.text_area("**Prompt:**", placeholder="Enter your prompt...")
 run = st.button("Run")
 
-local_execution_prompt = """
+local_execution_prompt: Final = """
 You are an intelligent AI agent designed to generate accurate python code.
 Here are your STRICT instructions:
 - If the question does not require writing code, provide a clear and concise answer without generating any code.
@@ -44,7 +84,7 @@ Here are your STRICT instructions:
 - If you are generating charts, graphs or anything visual, convert them to image and save it to the /tmp location and return as well as print just the name of the image file path.
 """
 
-docker_execution_prompt = """
+docker_execution_prompt: Final = """
 You are an intelligent AI agent designed to generate accurate python code.
 Here are your STRICT instructions:
 - If the question does not require writing code, provide a clear and concise answer without generating any code.
@@ -58,13 +98,27 @@ Here are your STRICT instructions:
 - If you are generating charts, graphs or anything visual, convert them to image and save it to the /app location and return as well as print just the name of the image file without path.
 """
 
-if execution_env == "docker":
-    messages = [SystemMessage(docker_execution_prompt)]
-else:
-    messages = [SystemMessage(local_execution_prompt)]
+
+@st.cache_resource
+def get_system_message(execution_env: str) -> SystemMessage:
+    """Returns the system message for the chosen execution environment.
+
+    Cached so the message isn't rebuilt on every Streamlit rerun.
+
+    Args:
+        execution_env: One of "None", "docker" or "local".
+
+    Returns:
+        SystemMessage: The instructions for generating code for that environment.
+    """
+    from langchain_core.messages import SystemMessage
+
+    if execution_env == "docker":
+        return SystemMessage(docker_execution_prompt)
+    return SystemMessage(local_execution_prompt)
 
 
-def get_code_group(llm_response: str) -> str | bool:
+def get_code_group(llm_response: str) -> str | None:
     """Extracts Python code from a markdown-formatted LLM response.
 
     Args:
@@ -73,110 +127,727 @@ def get_code_group(llm_response: str) -> str | bool:
 
     Returns:
         str: The extracted Python code if found.
-        bool: False if no Python code block is found.
+        None: If no Python code block is found.
     """
-    code_match = re.search(r"```python\n(.*?)```", llm_response, re.DOTALL)
+    code_match = CODE_BLOCK_RE.search(llm_response)
     print(">>> Code Match: ", code_match)
     if not code_match:
         print(">>> No Python code found in the response.")
-        return False
+        return None
 
     return code_match.group(1)
 
 
-def execute_local(temp_file_path: str) -> str:
-    """Executes a Python script locally and returns its output.
+class CodeFenceDetector:
+    """Incrementally finds the first ```python block while an LLM response streams in.
 
-    Runs the given Python script file using python3.10 interpreter in a subprocess
-    with a x second timeout. Captures and returns stdout/stderr.
+    Each chunk is only scanned together with the few preceding characters that could
+    complete a fence split across chunks, so the response isn't re-walked per token.
+    """
+
+    OPEN_FENCE = "```python\n"
+    CLOSE_FENCE = "```"
+
+    def __init__(self):
+        self.text = ""
+        self.code = None
+        self._code_start = None
+        self._scanned = 0
+
+    def feed(self, chunk: str) -> str | None:
+        """Appends a chunk of the response.
+
+        Args:
+            chunk: The next piece of streamed text.
+
+        Returns:
+            str: The extracted code, on the chunk that closes the code block.
+            None: Otherwise.
+        """
+        self.text += chunk
+        if self.code is not None:
+            return None
+
+        if self._code_start is None:
+            start = max(0, self._scanned - len(self.OPEN_FENCE) + 1)
+            index = self.text.find(self.OPEN_FENCE, start)
+            if index == -1:
+                self._scanned = len(self.text)
+                return None
+            self._code_start = self._scanned = index + len(self.OPEN_FENCE)
+
+        start = max(self._code_start, self._scanned - len(self.CLOSE_FENCE) + 1)
+        self._scanned = len(self.text)
+        if self.text.find(self.CLOSE_FENCE, start) == -1:
+            return None
+
+        self.code = get_code_group(self.text)
+        return self.code
+
+
+class SessionReaper:
+    """Tears down per-session workers and containers once their session has ended.
+
+    Streamlit has no session-end hook, so ended sessions are detected by polling
+    the runtime from a background thread. Everything still registered is torn
+    down when the app process exits.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cleanups: dict[str, list] = {}
+
+    def register(self, cleanup, *args) -> None:
+        """Registers `cleanup(*args)` to run when the current session ends.
+
+        Args:
+            cleanup: Callable that releases a resource owned by the session.
+            *args: Arguments `cleanup` is called with.
+        """
+        ctx = get_script_run_ctx()
+        session_id = ctx.session_id if ctx is not None else ""
+        with self._lock:
+            self._cleanups.setdefault(session_id, []).append((cleanup, args))
+
+    def reap(self) -> None:
+        """Runs the cleanups of every session that is no longer active."""
+        if not runtime.exists():
+            return
+        active = runtime.get_instance().is_active_session
+        with self._lock:
+            ended = [sid for sid in self._cleanups if sid and not active(sid)]
+            cleanups = [item for sid in ended for item in self._cleanups.pop(sid)]
+        self._run(cleanups)
+
+    def reap_forever(self) -> None:
+        """Calls `reap` every `REAP_INTERVAL` seconds; run in a daemon thread."""
+        while True:
+            time.sleep(REAP_INTERVAL)
+            self.reap()
+
+    def close_all(self) -> None:
+        """Runs every registered cleanup, whether or not its session has ended."""
+        with self._lock:
+            cleanups = [item for items in self._cleanups.values() for item in items]
+            self._cleanups.clear()
+        self._run(cleanups)
+
+    @staticmethod
+    def _run(cleanups: list) -> None:
+        """Runs cleanups one by one, so a failing one doesn't skip the rest.
+
+        Args:
+            cleanups: (cleanup, args) pairs popped from the registry.
+        """
+        for cleanup, args in cleanups:
+            # A failure must not kill the reaper thread or lose the other cleanups.
+            try:
+                cleanup(*args)
+            except Exception as e:  # noqa: BLE001
+                print(f">>> Session cleanup {cleanup.__name__} failed: {e!r}")
+
+
+@st.cache_resource
+def get_session_reaper() -> SessionReaper:
+    """Returns the app-wide `SessionReaper`, starting its polling thread once.
+
+    Returns:
+        SessionReaper: The reaper shared by all sessions.
+    """
+    reaper = SessionReaper()
+    threading.Thread(target=reaper.reap_forever, daemon=True).start()
+    atexit.register(reaper.close_all)
+    return reaper
+
+
+def stop_local_worker(worker: subprocess.Popen) -> None:
+    """Kills a worker started by `get_local_worker` and reaps it.
 
     Args:
-        temp_file_path: Path to the temporary Python script file to execute.
+        worker: The worker process to stop.
+    """
+    worker.kill()
+    worker.wait()
+
+
+def get_local_worker() -> subprocess.Popen:
+    """Returns the session's persistent Python worker, starting it on first use.
+
+    The worker (see worker.py) keeps a warm interpreter with numpy, pandas and
+    matplotlib already imported, and is restarted if it has exited. It runs in
+    isolated mode (-I), so it skips PYTHON* environment variables and the user
+    site-packages directory. It is killed once the session ends.
+
+    Returns:
+        subprocess.Popen: Handle to the running worker process.
+    """
+    worker = st.session_state.get("local_worker")
+    if worker is None or worker.poll() is not None:
+        worker = subprocess.Popen(
+            ["python3.10", "-I", "-u", str(WORKER_PATH)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            bufsize=0,
+        )
+        get_session_reaper().register(stop_local_worker, worker)
+        st.session_state["local_worker"] = worker
+    return worker
+
+
+@st.cache_resource
+def get_script_dir() -> Path:
+    """Returns the app's private directory for script files, creating it once.
+
+    The directory is made under `SCRIPT_ROOT` with mode 0700 and a random name, so
+    other users of the shared /dev/shm can't own or plant the predictable script
+    names inside it. It is removed when the app exits.
+
+    Returns:
+        Path: The script directory.
+    """
+    script_dir = Path(tempfile.mkdtemp(prefix="code-interpreter-", dir=SCRIPT_ROOT))
+    atexit.register(shutil.rmtree, script_dir, ignore_errors=True)
+    return script_dir
+
+
+def prune_scripts(script_dir: Path) -> None:
+    """Deletes all but the `MAX_CACHED_SCRIPTS` most recently used script files.
+
+    Partial files left behind by writes that didn't complete are deleted once they
+    are older than `STALE_PARTIAL_AGE` seconds.
+
+    Args:
+        script_dir: Directory returned by `get_script_dir`.
+    """
+
+    def last_used(path: Path) -> float:
+        try:
+            return path.stat().st_mtime
+        except FileNotFoundError:
+            return 0
+
+    scripts = sorted(script_dir.glob("interp_*.py"), key=last_used, reverse=True)
+    for script in scripts[MAX_CACHED_SCRIPTS:]:
+        script.unlink(missing_ok=True)
+
+    stale = time.time() - STALE_PARTIAL_AGE
+    for partial in script_dir.glob("interp_*.tmp"):
+        if last_used(partial) < stale:
+            partial.unlink(missing_ok=True)
+
+
+def write_script(code: str) -> Path:
+    """Writes code to a script file named after its hash, reusing an existing one.
+
+    Files live in the app's private directory in /dev/shm when available, so writing
+    them never touches disk, and old ones are pruned in the background instead of
+    being deleted after each run.
+
+    Args:
+        code: The Python code to write.
+
+    Returns:
+        Path: Path to the script file.
+    """
+    data = code.encode("utf-8")
+    script_dir = get_script_dir()
+    path = script_dir / f"interp_{hashlib.sha1(data).hexdigest()[:16]}.py"
+    try:
+        # Mark the file as recently used.
+        os.utime(path)
+    except FileNotFoundError:
+        partial = path.with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            partial.write_bytes(data)
+            partial.replace(path)
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+        threading.Thread(target=prune_scripts, args=(script_dir,), daemon=True).start()
+    return path
+
+
+def execute_local(code: str, script_path: Path) -> str:
+    """Executes Python code locally and returns its output.
+
+    Sends the code to the session's persistent python3.10 worker, which runs it with
+    a 10 second timeout and reports back stdout/stderr.
+
+    Args:
+        code: The Python code to execute.
+        script_path: Path of the script file holding the code, used as its
+            filename in tracebacks and as `__file__`.
 
     Returns:
         str: The stdout output if execution was successful, stderr if there were errors,
             or a timeout message if execution exceeded 10 seconds.
+    """
+    try:
+        worker = get_local_worker()
+        write_message(
+            worker.stdin,
+            {
+                "code": code,
+                "filename": str(script_path),
+                "timeout": 10,
+            },
+        )
+        response = read_message(worker.stdout)
+        if response is None:
+            worker.wait()
+            return ">>> Execution failed: the local worker exited unexpectedly."
 
-    Raises:
-        subprocess.TimeoutExpired: If script execution takes longer than 10 seconds.
+        print(">>> Running code completed!")
+        if response["timed_out"]:
+            return ">>> Execution timed out."
+        return response["stdout"] if response["rc"] == 0 else response["stderr"]
+    except BrokenPipeError:
+        return ">>> Execution failed: the local worker exited unexpectedly."
 
-    Note:
-        The temporary file is deleted after execution regardless of success/failure.
+
+@st.cache_resource
+def get_docker_client() -> docker.DockerClient:
+    """Returns a Docker client shared by all sessions of the app.
+
+    Returns:
+        docker.DockerClient: Client connected to the local Docker daemon.
+    """
+    import docker
+
+    return docker.from_env()
+
+
+def warm_docker() -> None:
+    """Makes sure the interpreter image is available and primes the Docker daemon.
+
+    Pulls the image if it is missing and runs a throwaway container that imports the
+    heavy libraries, so their layers are paged in before the first real execution.
+    Failures are only logged, since the docker environment may not be used at all.
     """
+    import docker
+
     try:
-        result = subprocess.run(
-            ["python3.10", temp_file_path], capture_output=True, text=True, timeout=10
+        client = get_docker_client()
+        try:
+            client.images.get(DOCKER_IMAGE)
+        except docker.errors.ImageNotFound:
+            client.images.pull(DOCKER_IMAGE)
+        client.containers.run(
+            DOCKER_IMAGE,
+            ["python", "-c", "import numpy, pandas, matplotlib.pyplot"],
+            remove=True,
         )
-        print(">>> Running code completed!")
-        return result.stdout if result.returncode == 0 else result.stderr
-    except subprocess.TimeoutExpired:
-        return ">>> Execution timed out."
-    finally:
-        os.unlink(temp_file_path)
+        print(">>> Docker warm-up completed!")
+    except docker.errors.DockerException as e:
+        print(f">>> Docker warm-up skipped: {e}")
+
+
+@st.cache_resource
+def start_docker_warmup() -> threading.Thread:
+    """Starts `warm_docker` in a background thread, once per app process.
+
+    Returns:
+        threading.Thread: The warm-up thread.
+    """
+    thread = threading.Thread(target=warm_docker, daemon=True)
+    thread.start()
+    return thread
 
 
-def execute_docker(temp_file_path: str) -> str:
-    """Executes a Python script in a Docker container and returns its output.
+def stop_docker_container(container) -> None:
+    """Stops and removes a container started by `get_docker_container`.
 
-    Runs the given Python script file in a Docker container using the code-interpreter-demo
-    image. Mounts the temporary script directory into the container and executes the script.
+    The container may already be gone, e.g. if it was replaced after it stopped, or
+    the daemon may be unreachable.
 
     Args:
-        temp_file_path: Path to the temporary Python script file to execute.
+        container: The Docker container to tear down.
+    """
+    import docker
+    import requests
+
+    try:
+        container.stop(timeout=1)
+        container.remove()
+    except (docker.errors.DockerException, requests.RequestException):
+        pass
+
+
+def get_docker_container():
+    """Returns the session's long-lived Docker container, starting it on first use.
+
+    The container idles on `sleep infinity` so scripts can be dispatched to it with
+    `docker exec` instead of paying the create/start/teardown cost on every prompt. Its
+    /app directory is an in-memory tmpfs, so nothing is shared with the host
+    filesystem. It is restarted if it has been stopped or removed behind our back,
+    and removed once the session ends.
+
+    Returns:
+        Container: The running code-interpreter-demo container for this session.
+    """
+    import docker
+
+    container = st.session_state.get("docker_container")
+    if container is not None:
+        try:
+            container.reload()
+            if container.status == "running":
+                return container
+        except docker.errors.NotFound:
+            pass
+
+    container = get_docker_client().containers.run(
+        DOCKER_IMAGE,
+        command="sleep infinity",
+        tmpfs={"/app": "size=64m"},
+        detach=True,
+        remove=False,
+    )
+    get_session_reaper().register(stop_docker_container, container)
+    st.session_state["docker_container"] = container
+    return container
+
+
+def read_docker_file(name: str) -> bytes:
+    """Reads a file written by the generated code to /app inside the container.
+
+    The file is read with `cat` through `docker exec`, because the archive API
+    can't see files on the tmpfs mounted at /app.
+
+    Args:
+        name: Name of the file relative to /app.
 
     Returns:
-        str: The stdout output from the container if execution was successful,
-            or an error message if container execution failed.
+        bytes: Contents of the file.
 
     Raises:
-        Exception: If there are any errors running the Docker container.
+        FileNotFoundError: If the file can't be read.
+    """
+    result = get_docker_container().exec_run(
+        ["cat", "--", name], stderr=False, workdir="/app"
+    )
+    if result.exit_code != 0:
+        raise FileNotFoundError(f"/app/{name} not found in the container")
+    return result.output
+
+
+def clear_docker_workdir() -> None:
+    """Deletes everything the generated code saved to the session container's /app.
+
+    The tmpfs lives as long as the container, so files left by each run would
+    otherwise pile up until it is full.
+    """
+    import docker
+    import requests
+
+    container = st.session_state.get("docker_container")
+    if container is None:
+        return
+    try:
+        container.exec_run(["find", "/app", "-mindepth", "1", "-delete"])
+    except (docker.errors.DockerException, requests.RequestException):
+        # A container that is gone is replaced with a fresh, empty tmpfs anyway.
+        pass
+
+
+def execute_docker(code: str, placeholder=None) -> str:
+    """Executes Python code in a Docker container and returns its output.
+
+    Passes the code to `python -c` in the session's long-lived code-interpreter-demo
+    container and runs it from /app, so files it saves can be read back with
+    `read_docker_file`. The code is sent in the exec itself, since the archive API
+    can't write to the tmpfs mounted at /app. Output is streamed as it is produced,
+    re-rendering the placeholder at most every `STREAM_RENDER_INTERVAL` seconds.
+
+    Args:
+        code: The Python code to execute.
+        placeholder: Optional Streamlit placeholder the output so far is shown in.
+
+    Returns:
+        str: The output from the container if execution was successful,
+            or an error message with the output if the script or the container
+            failed.
 
     Note:
-        The temporary file is deleted after execution regardless of success/failure.
-        The container is automatically removed after execution.
+        The container is kept running and is only removed once the session ends.
     """
-    client = docker.from_env()
     try:
-        container = client.containers.run(
-            "code-interpreter-demo:latest",
-            command=f"python /app/{Path(temp_file_path).name}",
-            volumes={os.path.dirname(temp_file_path): {"bind": "/app", "mode": "rw"}},
-            remove=True,
-        )
-        return container.decode("utf-8")
+        container = get_docker_container()
+        api = get_docker_client().api
+        command = ["python", "-c", code]
+        exec_id = api.exec_create(container.id, command, workdir="/app")["Id"]
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        parts = []
+        last_render = time.monotonic()
+        for chunk in api.exec_start(exec_id, stream=True):
+            parts.append(decoder.decode(chunk))
+            if (
+                placeholder is not None
+                and time.monotonic() - last_render >= STREAM_RENDER_INTERVAL
+            ):
+                placeholder.code("".join(parts))
+                last_render = time.monotonic()
+        parts.append(decoder.decode(b"", final=True))
+        output = "".join(parts)
+
+        exit_code = api.exec_inspect(exec_id)["ExitCode"]
+        if exit_code != 0:
+            return f"Failed running the container: exit code {exit_code}\n\n{output}"
+        return output
     except Exception as e:
         return f"Failed running the container: {str(e)}"
+
+
+def execute_code(code: str, execution_env: str, placeholder=None) -> str | None:
+    """Runs generated code in the chosen environment.
+
+    Args:
+        code: The Python code extracted from the LLM response.
+        execution_env: One of "None", "docker" or "local".
+        placeholder: Optional Streamlit placeholder for output streamed while the
+            code runs.
+
+    Returns:
+        str: The execution output.
+        None: If the code was not run.
+    """
+    if execution_env == "docker":
+        print(">>> Executing in Docker!")
+        return execute_docker(code, placeholder)
+
+    if execution_env == "local":
+        script_path = write_script(code)
+        print(f">>> Script file path is : {script_path}")
+
+        print(">>> Executing in Local Machine!")
+        return execute_local(code, script_path)
+
+    return None
+
+
+@st.cache_resource
+def get_llm() -> ChatGoogleGenerativeAI:
+    """Returns the chat model shared by all sessions of the app.
+
+    Returns:
+        ChatGoogleGenerativeAI: The Gemini chat model.
+    """
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(model="gemini-1.5-pro")
+
+
+@st.cache_resource
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Returns the long-lived event loop all LLM streams run on.
+
+    The model's async gRPC client is bound to the loop it is first used on, so the
+    cached model can only be reused across runs if they all share one loop.
+
+    Returns:
+        asyncio.AbstractEventLoop: An event loop running in a daemon thread.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+async def produce_chunks(llm, messages: list, chunks: queue.Queue) -> None:
+    """Puts the text of every streamed LLM chunk on a queue, followed by None.
+
+    Args:
+        llm: The chat model to stream from.
+        messages: The conversation to send to the model.
+        chunks: Queue the chunk texts are put on.
+    """
+    try:
+        async for chunk in llm.astream(messages):
+            chunks.put(chunk.content)
     finally:
-        os.unlink(temp_file_path)
+        chunks.put(None)
 
 
-if run:
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-pro")
-    messages += [HumanMessage(user_prompt)]
-    ai_message = llm.stream(messages)
-    output = st.write_stream(ai_message)
-
-    code = get_code_group(output)
-    if output and code:
-        with tempfile.NamedTemporaryFile(
-            mode="w", suffix=".py", delete=False
-        ) as temp_file:
-            temp_file.write(code)
-            temp_file_path = temp_file.name
-            print(f">>> Temp file path is : {temp_file_path}")
-
-        executed_result = None
-        if execution_env == "local":
-            print(">>> Executing in Local Machine!")
-            executed_result = execute_local(temp_file_path)
-        elif execution_env == "docker":
-            print(">>> Executing in Docker!")
-            executed_result = execute_docker(temp_file_path)
-
-        if executed_result and any(ext in executed_result for ext in (".png", ".jpg")):
-            if execution_env == "local":
-                st.image(executed_result.strip())
+def stream_response(llm, messages: list) -> Iterator[str]:
+    """Yields the text of every chunk of the LLM response as it streams in.
+
+    The response is streamed on the shared event loop while the caller consumes it.
+
+    Args:
+        llm: The chat model to stream from.
+        messages: The conversation to send to the model.
+
+    Yields:
+        str: The next piece of the response.
+    """
+    chunks = queue.Queue()
+    producer = asyncio.run_coroutine_threadsafe(
+        produce_chunks(llm, messages, chunks), get_event_loop()
+    )
+    yield from iter(chunks.get, None)
+    # Re-raise any error from the stream itself.
+    producer.result()
+
+
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=MAX_CACHED_RESPONSES)
+def generate_response(
+    prompt: str, execution_env: str, _chunks: queue.Queue | None = None
+) -> str:
+    """Returns the LLM's full response to a prompt, memoized for an hour.
+
+    Only the response text is cached, never rendered elements or execution output,
+    so it is only used where no code is run.
+
+    Args:
+        prompt: The user's prompt.
+        execution_env: One of "None", "docker" or "local".
+        _chunks: Optional queue every chunk is also put on while the response
+            streams in. Not part of the cache key, and left untouched on a hit.
+
+    Returns:
+        str: The full response text.
+    """
+    from langchain_core.messages import HumanMessage
+
+    messages = [get_system_message(execution_env), HumanMessage(prompt)]
+    parts = []
+    for text in stream_response(get_llm(), messages):
+        parts.append(text)
+        if _chunks is not None:
+            _chunks.put(text)
+    return "".join(parts)
+
+
+def stream_cached_response(prompt: str, execution_env: str) -> Iterator[str]:
+    """Yields the response to a prompt, taking it from the cache if possible.
+
+    `generate_response` runs in a worker thread, so a response that isn't cached yet
+    is still yielded chunk by chunk as it streams in. A cached one is yielded whole.
+
+    Args:
+        prompt: The user's prompt.
+        execution_env: One of "None", "docker" or "local".
+
+    Yields:
+        str: The next piece of the response.
+    """
+    chunks = queue.Queue()
+    with ThreadPoolExecutor(
+        max_workers=1,
+        initializer=add_script_run_ctx,
+        initargs=(None, get_script_run_ctx()),
+    ) as executor:
+        response = executor.submit(generate_response, prompt, execution_env, chunks)
+        response.add_done_callback(lambda _: chunks.put(None))
+        streamed = False
+        for text in iter(chunks.get, None):
+            streamed = True
+            yield text
+        # Re-raises any error from generating the response.
+        text = response.result()
+        if not streamed:
+            yield text
+
+
+def stream_and_execute(
+    chunks: Iterable[str],
+    execution_env: str,
+    placeholder,
+    result_placeholder,
+    show_stream: bool = True,
+) -> tuple[str, str | None]:
+    """Renders a streamed response into a placeholder and runs its code as it arrives.
+
+    Execution of the code is started in a worker thread as soon as its block closes,
+    and waited for only after the remaining chunks have been rendered.
+
+    Args:
+        chunks: The pieces of the response, as they stream in.
+        execution_env: One of "None", "docker" or "local".
+        placeholder: Streamlit placeholder the response is rendered into.
+        result_placeholder: Streamlit placeholder execution output is streamed into.
+        show_stream: Re-render the placeholder on every token. If False, it is only
+            filled once with the generated code after the response is complete.
+
+    Returns:
+        tuple: The full response text and the result of `execute_code`, or None if
+            the response had no code block or it was not run.
+    """
+    detector = CodeFenceDetector()
+    execution = None
+    with ThreadPoolExecutor(
+        max_workers=1,
+        initializer=add_script_run_ctx,
+        initargs=(None, get_script_run_ctx()),
+    ) as executor:
+        for text in chunks:
+            if code := detector.feed(text):
+                execution = executor.submit(
+                    execute_code, code, execution_env, result_placeholder
+                )
+            if show_stream:
+                placeholder.markdown(detector.text)
+
+        if not show_stream:
+            if detector.code:
+                placeholder.code(detector.code, language="python")
             else:
-                st.image(f"{os.path.dirname(temp_file_path)}/{executed_result.strip()}")
-        else:
-            st.write(executed_result)
+                placeholder.markdown(detector.text)
+
+        return detector.text, execution.result() if execution else None
+
+
+def run_pipeline(
+    prompt: str, execution_env: str, show_stream: bool = True
+) -> tuple[str, str | None]:
+    """Answers a prompt: streams the response, runs its code and renders the result.
+
+    Responses that don't run any code only depend on the prompt, so they come from
+    `generate_response`'s cache when possible. Executed code is never cached: its
+    output depends on the session's machine state.
+
+    Args:
+        prompt: The user's prompt.
+        execution_env: One of "None", "docker" or "local".
+        show_stream: Whether to render the response per token.
+
+    Returns:
+        tuple: The full response text and the execution output, or None if no
+            code was run.
+    """
+    from langchain_core.messages import HumanMessage
+
+    if execution_env == "None":
+        chunks = stream_cached_response(prompt, execution_env)
+    else:
+        messages = [get_system_message(execution_env), HumanMessage(prompt)]
+        chunks = stream_response(get_llm(), messages)
+    response_placeholder, result_placeholder = st.empty(), st.empty()
+    output, executed_result = stream_and_execute(
+        chunks,
+        execution_env,
+        response_placeholder,
+        result_placeholder,
+        show_stream,
+    )
+    if output and executed_result is not None:
+        try:
+            # The prompt asks for visual output to be printed as just the image path.
+            image_path = executed_result.strip().rsplit("\n", 1)[-1].strip()
+            if image_path.endswith(IMAGE_EXTENSIONS):
+                if execution_env == "local":
+                    result_placeholder.image(image_path)
+                else:
+                    result_placeholder.image(read_docker_file(image_path))
+            else:
+                result_placeholder.write(executed_result)
+        finally:
+            if execution_env == "docker":
+                clear_docker_workdir()
+
+    return output, executed_result
+
+
+start_docker_warmup()
+
+if run:
+    run_pipeline(user_prompt, execution_env, show_stream)
@@ -0,0 +1,238 @@
+"""Long-lived Python worker used by the `local` execution environment.
+
+The app starts this script once and sends it code to run over stdin, so the
+interpreter startup and the import of heavy libraries is paid only once. Each
+script runs in a child forked from this already-warm process, whose stdout and
+stderr are piped back here, and which is killed if it exceeds its timeout. Every
+message in both directions is a 4-byte big-endian length followed by UTF-8 JSON:
+
+    request:  {"code": "...", "filename": "...", "timeout": 10}
+    response: {"stdout": "...", "stderr": "...", "rc": 0, "timed_out": false}
+"""
+
+import builtins
+import contextlib
+import json
+import os
+import selectors
+import signal
+import struct
+import sys
+import time
+import traceback
+from types import CodeType
+from typing import BinaryIO, NoReturn
+
+HEADER = struct.Struct(">I")
+PREIMPORTS = ("numpy", "pandas", "matplotlib", "matplotlib.pyplot")
+# Seconds to keep reading output after the child exits, and how often to check
+# whether it has exited when pidfds aren't available.
+DRAIN_GRACE = 0.1
+EXIT_POLL_INTERVAL = 0.01
+
+
+def _read_exactly(stream: BinaryIO, size: int) -> bytes | None:
+    """Reads exactly `size` bytes from `stream`, or returns None on EOF."""
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def read_message(stream: BinaryIO) -> dict | None:
+    """Reads one length-prefixed JSON message.
+
+    Args:
+        stream: Binary stream to read from.
+
+    Returns:
+        dict: The decoded message.
+        None: If the stream was closed.
+    """
+    header = _read_exactly(stream, HEADER.size)
+    if header is None:
+        return None
+    payload = _read_exactly(stream, HEADER.unpack(header)[0])
+    if payload is None:
+        return None
+    return json.loads(payload)
+
+
+def write_message(stream: BinaryIO, message: dict) -> None:
+    """Writes one length-prefixed JSON message and flushes the stream.
+
+    Args:
+        stream: Binary stream to write to.
+        message: JSON-serializable message.
+    """
+    payload = json.dumps(message).encode("utf-8")
+    stream.write(HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+
+def run_child(code: CodeType, stdout_fd: int, stderr_fd: int) -> NoReturn:
+    """Runs code in a fresh module namespace and exits; called in the forked child.
+
+    Args:
+        code: The compiled script to run.
+        stdout_fd: Write end of the pipe that becomes the child's stdout.
+        stderr_fd: Write end of the pipe that becomes the child's stderr.
+    """
+    os.dup2(stdout_fd, sys.stdout.fileno())
+    os.dup2(stderr_fd, sys.stderr.fileno())
+    namespace = {
+        "__name__": "__main__",
+        "__file__": code.co_filename,
+        "__builtins__": builtins,
+    }
+    rc = 0
+
+    try:
+        # Running the generated code is the whole point of this worker.
+        exec(code, namespace)  # noqa: S102
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            rc = e.code or 0
+        else:
+            # Like the interpreter, print a non-integer exit argument and fail.
+            print(e.code, file=sys.stderr)
+            rc = 1
+    # Any failure in user code must be reported back, not crash the child silently.
+    except BaseException as e:  # noqa: BLE001
+        # Drop this frame so the traceback starts at the user's code.
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        rc = 1
+    finally:
+        with contextlib.suppress(Exception):
+            sys.stdout.flush()
+            sys.stderr.flush()
+        os._exit(rc)
+
+
+def wait_for_child(
+    pid: int, fds: list[int], timeout: float
+) -> tuple[dict[int, bytes], int | None]:
+    """Collects a child's output until it exits or the timeout expires.
+
+    Completion is based on the child exiting, not on its pipes closing: processes
+    it left running in the background may hold them open. After the child exits,
+    the pipes are drained for at most `DRAIN_GRACE` seconds.
+
+    Args:
+        pid: Process id of the child.
+        fds: Read ends of the child's output pipes. They are closed before returning.
+        timeout: Seconds to wait for the child to exit.
+
+    Returns:
+        tuple: The data read from each pipe, and the child's wait status, or None
+            if it was still running at the deadline.
+    """
+    deadline = time.monotonic() + timeout
+    data = {fd: b"" for fd in fds}
+    status = None
+    # A pidfd becomes readable when the child exits; without one, poll for it.
+    pidfd = os.pidfd_open(pid) if hasattr(os, "pidfd_open") else None
+    with selectors.DefaultSelector() as selector:
+        for fd in fds:
+            selector.register(fd, selectors.EVENT_READ)
+        if pidfd is not None:
+            selector.register(pidfd, selectors.EVENT_READ)
+
+        while True:
+            if status is None:
+                exited, exit_status = os.waitpid(pid, os.WNOHANG)
+                if exited:
+                    status = exit_status
+                    deadline = time.monotonic() + DRAIN_GRACE
+            pipes_open = any(key.fd != pidfd for key in selector.get_map().values())
+            remaining = deadline - time.monotonic()
+            if (status is not None and not pipes_open) or remaining <= 0:
+                break
+
+            if status is None and pidfd is None:
+                remaining = min(remaining, EXIT_POLL_INTERVAL)
+            for key, _ in selector.select(remaining):
+                if key.fd == pidfd:
+                    selector.unregister(pidfd)
+                elif chunk := os.read(key.fd, 65536):
+                    data[key.fd] += chunk
+                else:
+                    selector.unregister(key.fd)
+
+    for fd in fds:
+        os.close(fd)
+    if pidfd is not None:
+        os.close(pidfd)
+    return data, status
+
+
+def execute(request: dict) -> dict:
+    """Executes the code of a single request in a child forked from this process.
+
+    The code is compiled here first, so syntax errors are reported without forking.
+    On timeout only the child is killed; this process and its imports stay warm.
+
+    Args:
+        request: Request with the `code` to run, the `filename` used in tracebacks,
+            and the `timeout` in seconds.
+
+    Returns:
+        dict: Captured stdout/stderr, the return code and whether it timed out.
+    """
+    try:
+        code = compile(request["code"], request.get("filename", "<user>"), "exec")
+    except (SyntaxError, ValueError) as e:
+        return {
+            "stdout": "",
+            "stderr": "".join(traceback.format_exception_only(type(e), e)),
+            "rc": 1,
+            "timed_out": False,
+        }
+
+    stdout_r, stdout_w = os.pipe()
+    stderr_r, stderr_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(stdout_r)
+        os.close(stderr_r)
+        run_child(code, stdout_w, stderr_w)
+
+    os.close(stdout_w)
+    os.close(stderr_w)
+    output, status = wait_for_child(
+        pid, [stdout_r, stderr_r], request.get("timeout", 10)
+    )
+    timed_out = status is None
+    if timed_out:
+        os.kill(pid, signal.SIGKILL)
+        _, status = os.waitpid(pid, 0)
+
+    return {
+        "stdout": output[stdout_r].decode("utf-8", errors="replace"),
+        "stderr": output[stderr_r].decode("utf-8", errors="replace"),
+        "rc": os.waitstatus_to_exitcode(status),
+        "timed_out": timed_out,
+    }
+
+
+def main() -> None:
+    requests = os.fdopen(os.dup(sys.stdin.fileno()), "rb")
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    # Keep fd-level reads/writes from user code (os.system, C extensions) off the
+    # protocol pipes.
+    os.dup2(os.open(os.devnull, os.O_RDONLY), sys.stdin.fileno())
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    for module in PREIMPORTS:
+        with contextlib.suppress(ImportError):
+            __import__(module)
+
+    while (request := read_message(requests)) is not None:
+        write_message(responses, execute(request))
+
+
+if __name__ == "__main__":
+    main()